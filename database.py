@@ -5,11 +5,12 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.write_concern import WriteConcern
 from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
-from typing import Union
+from typing import Optional, Union
 from pydantic import BaseModel
 
 # Load environment variables from .env file
@@ -21,13 +22,41 @@ db = None
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
-if database_url and database_name:
-    _client = MongoClient(database_url)
-    db = _client[database_name]
+def connect_db():
+    """Create the async client and return the database handle (None if not configured)"""
+    global _client, db
+    if _client is None and database_url and database_name:
+        _client = AsyncIOMotorClient(
+            database_url,
+            maxPoolSize=50,
+            minPoolSize=5,
+            waitQueueTimeoutMS=1000,
+            tz_aware=True,
+        )
+        db = _client[database_name]
+    return db
+
+def close_db():
+    """Close the client and release its connection pool"""
+    global _client, db
+    if _client is not None:
+        _client.close()
+    _client = None
+    db = None
 
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
-    """Insert a single document with timestamp"""
+async def create_document(
+    collection_name: str,
+    data: Union[BaseModel, dict],
+    write_concern: Optional[WriteConcern] = None,
+    bypass_document_validation: bool = False,
+):
+    """Insert a single document with timestamp and return it (including its _id)
+
+    write_concern overrides the database default (e.g. w=0 for fire-and-forget);
+    bypass_document_validation skips server-side schema validation for
+    payloads already validated by the API layer.
+    """
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
 
@@ -37,13 +66,19 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     else:
         data_dict = data.copy()
 
-    data_dict['created_at'] = datetime.now(timezone.utc)
-    data_dict['updated_at'] = datetime.now(timezone.utc)
+    # BSON dates keep milliseconds only; truncate so the returned document
+    # matches what a later read of it gives back
+    now = datetime.now(timezone.utc)
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    data_dict['created_at'] = now
+    data_dict['updated_at'] = now
 
-    result = db[collection_name].insert_one(data_dict)
-    return str(result.inserted_id)
+    collection = db.get_collection(collection_name, write_concern=write_concern)
+    result = await collection.insert_one(data_dict, bypass_document_validation=bypass_document_validation)
+    data_dict['_id'] = result.inserted_id
+    return data_dict
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
     """Get documents from collection"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -52,4 +87,4 @@ def get_documents(collection_name: str, filter_dict: dict = None, limit: int = N
     if limit:
         cursor = cursor.limit(limit)
     
-    return list(cursor)
+    return await cursor.to_list(length=None)
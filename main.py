@@ -1,14 +1,67 @@
+import asyncio
+import hashlib
+import hmac
+import logging
 import os
-from typing import List, Optional, Any, Dict
-from fastapi import FastAPI, HTTPException, Depends, Header
+import re
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Optional, Any, Dict, Tuple
+from cachetools import TTLCache
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
+from pydantic_core import core_schema
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
+from pymongo.write_concern import WriteConcern
 
-from database import db, create_document, get_documents
+from database import db, connect_db, close_db, create_document, get_documents
 from schemas import Product, Category, ContactMessage, AdminCredentials
 
-app = FastAPI(title="Product Catalog API")
+logger = logging.getLogger(__name__)
+
+
+async def ensure_indexes():
+    """Create the indexes backing the catalog queries (no-op if they exist)"""
+    # Equality field first, then the sort field (ESR); price range filters
+    # are served by the same {category, price} index.
+    await db["product"].create_index([("category", 1), ("price", 1)], background=True)
+    await db["product"].create_index([("category", 1), ("name", 1)], background=True)
+    await db["product"].create_index([("featured", 1), ("name", 1)], background=True)
+    await db["product"].create_index([("name", "text")], background=True)
+    try:
+        await db["category"].create_index("slug", unique=True)
+    except OperationFailure as e:
+        # Existing duplicate slugs must not keep the workers from booting
+        logger.warning("Could not create unique index on category.slug: %s", e)
+    await db["category"].create_index([("name", 1)])
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global db
+    db = connect_db()
+    if db is not None:
+        try:
+            # Open connections (DNS/TLS included) before accepting traffic
+            await asyncio.gather(
+                db.command("ping"),
+                db["product"].find_one({}, {"_id": 1}),
+                db["category"].find_one({}, {"_id": 1}),
+            )
+            await ensure_indexes()
+        except Exception as e:
+            # Keep serving; /test reports the connection problem
+            logger.error("Database warm-up failed: %s", e)
+    yield
+    close_db()
+
+
+app = FastAPI(title="Product Catalog API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,49 +70,133 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 
 # Helpers
-class ObjectIdStr(str):
+# Settings are read once at import; changing them requires a restart
+ADMIN_USER = os.getenv("ADMIN_USER", "admin")
+ADMIN_PASS = os.getenv("ADMIN_PASS", "admin123")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "admin-token")
+PORT = int(os.getenv("PORT", 8000))
+_ADMIN_USER_BYTES = ADMIN_USER.encode()
+_ADMIN_PASS_BYTES = ADMIN_PASS.encode()
+_ADMIN_TOKEN_BYTES = ADMIN_TOKEN.encode()
+BEARER_PREFIX = "Bearer "
+
+# Fields needed for product cards; the detail endpoint returns the full document.
+# The _id -> id rename happens server-side so list items need no rewrite pass.
+LIST_PROJECTION = {
+    "_id": 0,
+    "id": {"$toString": "$_id"},
+    "name": 1,
+    "price": 1,
+    "category": 1,
+    "images": {"$slice": 1},
+    "in_stock": 1,
+    "featured": 1,
+}
+
+CATEGORY_PROJECTION = {"name": 1, "slug": 1, "description": 1}
+
+# Pre-serialized (body, etag) pairs for the read-mostly storefront endpoints.
+# Caches are per worker process: a write clears only the worker that handled
+# it, so other workers may serve the old payload until their TTL expires.
+_cat_cache: TTLCache = TTLCache(maxsize=16, ttl=60)
+_featured_cache: TTLCache = TTLCache(maxsize=16, ttl=60)
+
+
+class PyObjectId(ObjectId):
+    """Hex string parameter parsed once into an ObjectId"""
+
     @classmethod
-    def __get_validators__(cls):
-        yield cls.validate
+    def __get_pydantic_core_schema__(cls, source_type, handler):
+        return core_schema.no_info_after_validator_function(cls.validate, core_schema.str_schema())
 
     @classmethod
     def validate(cls, v):
-        try:
-            return str(ObjectId(str(v)))
-        except Exception:
+        if not ObjectId.is_valid(v):
             raise ValueError("Invalid ObjectId")
+        return ObjectId(v)
 
 
 def serialize_doc(doc: Dict[str, Any]):
     if not doc:
         return doc
-    doc["id"] = str(doc.get("_id"))
-    doc.pop("_id", None)
-    return doc
+    return {**{k: v for k, v in doc.items() if k != "_id"}, "id": str(doc.get("_id"))}
+
+
+@lru_cache(maxsize=256)
+def build_regex(search: str) -> str:
+    """Anchored, escaped prefix pattern for user-supplied search text"""
+    return f"^{re.escape(search)}"
+
 
+def keyset_filter(after: str, sort_field: Optional[str], sort_dir: int) -> Dict[str, Any]:
+    """Filter selecting documents after an opaque `<sort value>:<id>` cursor"""
+    value, _, last_id = after.rpartition(":")
+    if not ObjectId.is_valid(last_id):
+        raise HTTPException(400, detail="Invalid cursor")
+    op = "$gt" if sort_dir == 1 else "$lt"
+    id_filter = {"_id": {op: ObjectId(last_id)}}
+    if not sort_field:
+        return id_filter
+    if sort_field == "price":
+        try:
+            value = float(value)
+        except ValueError:
+            raise HTTPException(400, detail="Invalid cursor")
+    # _id breaks ties between documents sharing the same sort value
+    return {"$or": [{sort_field: {op: value}}, {sort_field: value, **id_filter}]}
+
+
+# Clients must revalidate every time, so admin edits show up immediately;
+# unchanged payloads still come back as an empty 304.
+CACHE_CONTROL = "no-cache"
+
+
+def cache_entry(content: Any) -> Tuple[bytes, str]:
+    body = ORJSONResponse(content).body
+    # Weak tag: GZipMiddleware may re-encode the body without changing it
+    return body, f'W/"{hashlib.md5(body, usedforsecurity=False).hexdigest()}"'
 
-def admin_token() -> str:
-    return os.getenv("ADMIN_TOKEN", "admin-token")
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison, as If-None-Match requires"""
+    if not if_none_match:
+        return False
+    opaque = etag.removeprefix("W/")
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == opaque:
+            return True
+    return False
+
+
+def cached_json(request: Request, entry: Tuple[bytes, str]) -> Response:
+    """Serve a cache entry, answering 304 when the client already has it"""
+    body, etag = entry
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 def require_auth(authorization: Optional[str] = Header(None)):
-    token = admin_token()
-    if not authorization or not authorization.startswith("Bearer "):
+    if not authorization or not authorization.startswith(BEARER_PREFIX):
         raise HTTPException(status_code=401, detail="Unauthorized")
-    provided = authorization.split(" ", 1)[1]
-    if provided != token:
+    provided = authorization[len(BEARER_PREFIX):].encode()
+    if not hmac.compare_digest(provided, _ADMIN_TOKEN_BYTES):
         raise HTTPException(status_code=401, detail="Invalid token")
 
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Product Catalog Backend is running"}
 
 
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -75,7 +212,7 @@ def test_database():
             response["database_name"] = getattr(db, "name", None) or ""
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                collections = await db.list_collection_names()
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -89,52 +226,63 @@ def test_database():
 
 # Auth
 @app.post("/api/auth/login")
-def login(payload: AdminCredentials):
+async def login(payload: AdminCredentials):
     # Simple env-based auth for demo
-    env_user = os.getenv("ADMIN_USER", "admin")
-    env_pass = os.getenv("ADMIN_PASS", "admin123")
-    if payload.username == env_user and payload.password == env_pass:
-        return {"token": admin_token(), "user": {"name": env_user}}
+    user_ok = hmac.compare_digest(payload.username.encode(), _ADMIN_USER_BYTES)
+    pass_ok = hmac.compare_digest(payload.password.encode(), _ADMIN_PASS_BYTES)
+    if user_ok and pass_ok:
+        return {"token": ADMIN_TOKEN, "user": {"name": ADMIN_USER}}
     raise HTTPException(status_code=401, detail="Invalid credentials")
 
 
 # Categories CRUD
 @app.get("/api/categories")
-def list_categories() -> List[dict]:
-    items = list(db["category"].find({}).sort("name", 1)) if db else []
-    return [serialize_doc(i) for i in items]
+async def list_categories(request: Request):
+    entry = _cat_cache.get("all")
+    if entry is None:
+        items = []
+        if db is not None:
+            items = await db["category"].find({}, CATEGORY_PROJECTION).sort("name", 1).to_list(length=None)
+        entry = cache_entry([serialize_doc(i) for i in items])
+        _cat_cache["all"] = entry
+    return cached_json(request, entry)
 
 
 @app.post("/api/categories")
-def create_category(cat: Category, _: Any = Depends(require_auth)):
+async def create_category(cat: Category, _: Any = Depends(require_auth)):
     # ensure unique slug
-    if db["category"].find_one({"slug": cat.slug}):
+    if await db["category"].find_one({"slug": cat.slug}):
         raise HTTPException(400, detail="Slug already exists")
-    new_id = create_document("category", cat)
-    created = db["category"].find_one({"_id": ObjectId(new_id)})
+    created = await create_document("category", cat)
+    _cat_cache.clear()
     return serialize_doc(created)
 
 
 @app.put("/api/categories/{category_id}")
-def update_category(category_id: ObjectIdStr, cat: Category, _: Any = Depends(require_auth)):
-    res = db["category"].update_one({"_id": ObjectId(category_id)}, {"$set": cat.model_dump()})
-    if res.matched_count == 0:
+async def update_category(category_id: PyObjectId, cat: Category, _: Any = Depends(require_auth)):
+    doc = await db["category"].find_one_and_update(
+        {"_id": category_id},
+        {"$set": cat.model_dump()},
+        return_document=ReturnDocument.AFTER,
+    )
+    if doc is None:
         raise HTTPException(404, detail="Category not found")
-    doc = db["category"].find_one({"_id": ObjectId(category_id)})
+    _cat_cache.clear()
     return serialize_doc(doc)
 
 
 @app.delete("/api/categories/{category_id}")
-def delete_category(category_id: ObjectIdStr, _: Any = Depends(require_auth)):
-    res = db["category"].delete_one({"_id": ObjectId(category_id)})
+async def delete_category(category_id: PyObjectId, _: Any = Depends(require_auth)):
+    res = await db["category"].delete_one({"_id": category_id})
     if res.deleted_count == 0:
         raise HTTPException(404, detail="Category not found")
+    _cat_cache.clear()
     return {"status": "deleted"}
 
 
 # Products CRUD + listing
 @app.get("/api/products")
-def list_products(
+async def list_products(
     search: Optional[str] = None,
     category: Optional[str] = None,
     minPrice: Optional[float] = None,
@@ -142,6 +290,7 @@ def list_products(
     sort: Optional[str] = None,  # price_asc, price_desc, name_asc
     page: int = 1,
     limit: int = 12,
+    after: Optional[str] = None,  # next_cursor from the previous page
 ):
     if page < 1:
         page = 1
@@ -149,8 +298,15 @@ def list_products(
         limit = 12
 
     q: Dict[str, Any] = {}
+    search = search.strip() if search else None
     if search:
-        q["name"] = {"$regex": search, "$options": "i"}
+        if len(search.split()) > 1:
+            # Multi-word queries go through the text index
+            q["$text"] = {"$search": search}
+        else:
+            # Escaped, anchored prefix match. Being case-insensitive it gets no
+            # tight index bounds, but the other filters still use their indexes.
+            q["name"] = {"$regex": build_regex(search), "$options": "i"}
     if category:
         q["category"] = category
     if minPrice is not None or maxPrice is not None:
@@ -170,69 +326,109 @@ def list_products(
     elif sort == "name_asc":
         sort_field, sort_dir = "name", 1
 
-    cursor = db["product"].find(q)
-    total = db["product"].count_documents(q)
+    page_q = q
+    if after:
+        keyset = keyset_filter(after, sort_field, sort_dir)
+        page_q = {"$and": [q, keyset]} if q else keyset
+    cursor = db["product"].find(page_q, LIST_PROJECTION)
     if sort_field:
-        cursor = cursor.sort(sort_field, sort_dir)
-    cursor = cursor.skip((page - 1) * limit).limit(limit)
-    items = [serialize_doc(i) for i in cursor]
-    return {"items": items, "total": total, "page": page, "limit": limit}
+        cursor = cursor.sort([(sort_field, sort_dir), ("_id", sort_dir)])
+    else:
+        cursor = cursor.sort("_id", 1)
+    if not after:
+        cursor = cursor.skip((page - 1) * limit)
+    cursor = cursor.limit(limit)
+    # Unfiltered listings can use the collection metadata count
+    if q:
+        count = db["product"].count_documents(q)
+    else:
+        count = db["product"].estimated_document_count()
+    items, total = await asyncio.gather(cursor.to_list(length=limit), count)
+    next_cursor = None
+    if len(items) == limit:
+        last = items[-1]
+        next_cursor = f"{last[sort_field]}:{last['id']}" if sort_field else last["id"]
+    return {"items": items, "total": total, "page": page, "limit": limit, "next_cursor": next_cursor}
 
 
 @app.get("/api/products/featured")
-def featured_products(limit: int = 8):
-    cursor = db["product"].find({"featured": True}).sort("name", 1).limit(limit)
-    return [serialize_doc(i) for i in cursor]
+async def featured_products(request: Request, limit: int = 8):
+    entry = _featured_cache.get(limit)
+    if entry is None:
+        cursor = db["product"].find({"featured": True}).sort("name", 1).limit(limit)
+        entry = cache_entry([serialize_doc(i) async for i in cursor])
+        _featured_cache[limit] = entry
+    return cached_json(request, entry)
 
 
 @app.get("/api/products/{product_id}")
-def get_product(product_id: ObjectIdStr):
-    doc = db["product"].find_one({"_id": ObjectId(product_id)})
+async def get_product(product_id: PyObjectId):
+    doc = await db["product"].find_one({"_id": product_id})
     if not doc:
         raise HTTPException(404, detail="Product not found")
     return serialize_doc(doc)
 
 
 @app.post("/api/products")
-def create_product(prod: Product, _: Any = Depends(require_auth)):
-    new_id = create_document("product", prod)
-    created = db["product"].find_one({"_id": ObjectId(new_id)})
+async def create_product(prod: Product, _: Any = Depends(require_auth)):
+    # Already validated by Pydantic; keep the default acknowledged write
+    created = await create_document("product", prod, bypass_document_validation=True)
+    _featured_cache.clear()
     return serialize_doc(created)
 
 
 @app.put("/api/products/{product_id}")
-def update_product(product_id: ObjectIdStr, prod: Product, _: Any = Depends(require_auth)):
-    res = db["product"].update_one({"_id": ObjectId(product_id)}, {"$set": prod.model_dump()})
-    if res.matched_count == 0:
+async def update_product(product_id: PyObjectId, prod: Product, _: Any = Depends(require_auth)):
+    doc = await db["product"].find_one_and_update(
+        {"_id": product_id},
+        {"$set": prod.model_dump()},
+        return_document=ReturnDocument.AFTER,
+        # Raw findAndModify field passed through **kwargs; pymongo has no
+        # snake_case bypass_document_validation option for this method
+        bypassDocumentValidation=True,
+    )
+    if doc is None:
         raise HTTPException(404, detail="Product not found")
-    doc = db["product"].find_one({"_id": ObjectId(product_id)})
+    _featured_cache.clear()
     return serialize_doc(doc)
 
 
 @app.delete("/api/products/{product_id}")
-def delete_product(product_id: ObjectIdStr, _: Any = Depends(require_auth)):
-    res = db["product"].delete_one({"_id": ObjectId(product_id)})
+async def delete_product(product_id: PyObjectId, _: Any = Depends(require_auth)):
+    res = await db["product"].delete_one({"_id": product_id})
     if res.deleted_count == 0:
         raise HTTPException(404, detail="Product not found")
+    _featured_cache.clear()
     return {"status": "deleted"}
 
 
 # Admin summary
 @app.get("/api/admin/summary")
-def admin_summary(_: Any = Depends(require_auth)):
-    prod_count = db["product"].count_documents({})
-    cat_count = db["category"].count_documents({})
+async def admin_summary(_: Any = Depends(require_auth)):
+    # Metadata counts, fetched concurrently; dashboard totals need not be exact
+    prod_count, cat_count = await asyncio.gather(
+        db["product"].estimated_document_count(),
+        db["category"].estimated_document_count(),
+    )
     return {"products": prod_count, "categories": cat_count}
 
 
 # Contact form
 @app.post("/api/contact")
-def submit_contact(payload: ContactMessage):
-    _ = create_document("contactmessage", payload)
+async def submit_contact(payload: ContactMessage):
+    # Contact messages are at-most-once: w=0 returns without waiting for the
+    # server ack, so a failed write is silently lost.
+    _ = await create_document("contactmessage", payload, write_concern=WriteConcern(w=0))
     return {"status": "received"}
 
 
 if __name__ == "__main__":
     import uvicorn
-    port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=PORT,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", 4)),
+    )